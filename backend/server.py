@@ -1,33 +1,84 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks, Response, UploadFile, File, Form
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, WriteConcern
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Dict, Optional
 import uuid
 from datetime import datetime
 import fal_client
-import base64
+import httpx
+import pybase64
 import io
 from PIL import Image
+from pic_scale import Plan, Resampling
+from functools import lru_cache
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import random
+from blake3 import blake3
+from cachetools import LRUCache, TTLCache
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=100,
+    minPoolSize=10,
+    retryWrites=True,
+    compressors="zstd"
+)
 db = client[os.environ['DB_NAME']]
 
+# Status checks are telemetry; don't wait for replication or the journal
+status_checks = db.get_collection("status_checks", write_concern=WriteConcern(w=1, j=False))
+
 # FAL.AI Setup
 fal_key = os.environ.get('FAL_KEY')
 if fal_key:
     os.environ["FAL_KEY"] = fal_key
 
+# Uploaded images are normalized to fit within this size
+IMAGE_SIZE = (512, 512)
+RESIZE_MODES = ("L", "LA", "RGB", "RGBA")
+
+# Image decoding runs here so it doesn't block the event loop
+POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Virtual try-on prompt, filled in with the measurements and style
+PROMPT_TMPL = (
+    "Create a photorealistic virtual try-on image showing a person wearing the provided clothing item. "
+    "The person should match these measurements: height {height}cm, weight {weight}kg, "
+    "chest {chest}cm, waist {waist}cm, hips {hips}cm. "
+    "Style preference: {style}. "
+    "The clothing should fit naturally and realistically on the person's body. "
+    "Maintain the original person's appearance and facial features while showing them wearing the new outfit. "
+    "The final image should look natural, well-lit, and professional."
+)
+
+# Typical FAL generation time, used to pace client polling
+EXPECTED_TRYON_SECONDS = 20
+# Jobs still processing after this long were lost, e.g. to a restart
+STALE_TRYON_SECONDS = 5 * EXPECTED_TRYON_SECONDS
+
+# Ids of try-ons this process is still generating (the app runs as one uvicorn process)
+active_tryons = set()
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -54,7 +105,7 @@ class TryOnResult(BaseModel):
     name: str
     user_image_url: Optional[str] = None
     clothing_image_url: Optional[str] = None
-    tryon_image: Optional[str] = None  # base64 encoded result
+    tryon_image: Optional[str] = None  # FAL image URL
     measurements: Dict
     style: str
     feedback: Optional[str] = None
@@ -70,88 +121,340 @@ class StatusCheckCreate(BaseModel):
     client_name: str
 
 # Utility functions
-def base64_to_pil(base64_str):
-    """Convert base64 string to PIL Image"""
+@lru_cache(maxsize=32)
+def get_resize_plan(src_size, mode):
+    """Get a cached Lanczos resize plan fitting src_size within IMAGE_SIZE"""
+    scale = min(IMAGE_SIZE[0] / src_size[0], IMAGE_SIZE[1] / src_size[1])
+    dst_size = (max(1, round(src_size[0] * scale)), max(1, round(src_size[1] * scale)))
+    return Plan(
+        src_size=src_size,
+        dst_size=dst_size,
+        resampling=Resampling.LANCZOS,
+        mode=mode,
+        premultiply_alpha=True,
+        workers=0
+    )
+
+def detect_image_format(image_data):
+    """Detect the image format from its leading magic bytes"""
+    if image_data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if image_data.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+def bytes_to_pil(image_data):
+    """Convert encoded image bytes to a PIL Image fitting IMAGE_SIZE"""
     try:
-        # Remove data URL prefix if present
-        if base64_str.startswith('data:image'):
-            base64_str = base64_str.split(',')[1]
+        image_format = detect_image_format(image_data)
+        if not image_format:
+            logger.warning("Unsupported image format")
+            return None
+        
+        image = Image.open(io.BytesIO(image_data), formats=[image_format])
         
-        image_data = base64.b64decode(base64_str)
-        image = Image.open(io.BytesIO(image_data))
+        # Let libjpeg downscale while decoding, then finish with Lanczos
+        image.draft("RGB", IMAGE_SIZE)
+        if image.width > IMAGE_SIZE[0] or image.height > IMAGE_SIZE[1]:
+            if image.mode not in RESIZE_MODES:
+                has_alpha = "transparency" in image.info or image.mode.endswith("A")
+                image = image.convert("RGBA" if has_alpha else "RGB")
+            image = get_resize_plan(image.size, image.mode).resize(image)
         return image
-    except Exception as e:
-        logging.error(f"Error converting base64 to PIL: {e}")
+    except Exception:
+        logger.exception("Error converting bytes to PIL")
+        return None
+
+def strip_data_url(base64_str):
+    """Remove the data URL prefix from a base64 string if present"""
+    if base64_str.startswith('data:image'):
+        return base64_str.split(',', 1)[1]
+    return base64_str
+
+def image_header(image_data):
+    """Get the leading bytes of an upload, decoding only the start of base64 input"""
+    if isinstance(image_data, str):
+        # 16 base64 characters decode to the 12 bytes detect_image_format looks at
+        try:
+            return pybase64.b64decode(strip_data_url(image_data)[:16], validate=False)
+        except ValueError:
+            return b""
+    return image_data[:12]
+
+def base64_to_pil(base64_str):
+    """Convert base64 string to PIL Image"""
+    try:
+        image_data = pybase64.b64decode(strip_data_url(base64_str), validate=False)
+    except Exception:
+        logger.exception("Error converting base64 to PIL")
         return None
+    return bytes_to_pil(image_data)
 
 def pil_to_base64(pil_image):
     """Convert PIL Image to base64 string"""
     try:
         buffered = io.BytesIO()
         pil_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        img_str = pybase64.b64encode_as_string(buffered.getvalue())
         return f"data:image/png;base64,{img_str}"
-    except Exception as e:
-        logging.error(f"Error converting PIL to base64: {e}")
+    except Exception:
+        logger.exception("Error converting PIL to base64")
         return None
 
-async def generate_virtual_tryon(user_image_b64, clothing_image_b64, measurements, style, name):
-    """Generate virtual try-on using FAL.AI"""
+async def fetch_image_base64(url):
+    """Download an image and return it as a base64 data URL"""
+    response = await app.state.http.get(url)
+    response.raise_for_status()
+    content_type = response.headers.get("content-type", "image/png")
+    img_str = pybase64.b64encode_as_string(response.content)
+    return f"data:{content_type};base64,{img_str}"
+
+# Encoded try-on images keyed by URL; values are the tasks producing them
+image_base64_cache = LRUCache(maxsize=64)
+
+def cached_image_base64(url):
+    """Get a shared task encoding url, so repeat and concurrent requests fetch it once"""
+    task = image_base64_cache.get(url)
+    if task is None:
+        task = asyncio.ensure_future(fetch_image_base64(url))
+        image_base64_cache[url] = task
+        
+        def evict_failed(task):
+            # Don't keep serving a failed download
+            if (task.cancelled() or task.exception()) and image_base64_cache.get(url) is task:
+                del image_base64_cache[url]
+        
+        task.add_done_callback(evict_failed)
+    return task
+
+async def collect_batch(queue, max_batch_size, max_wait_time):
+    """Wait for one queued item, then gather more until the batch fills or the window closes"""
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + max_wait_time
+    
     try:
-        logging.info(f"Starting virtual try-on generation for {name}")
+        while len(batch) < max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+    except asyncio.CancelledError:
+        # Hand collected items back so whoever stops the worker can settle them
+        for item in batch:
+            queue.put_nowait(item)
+        raise
+    return batch
+
+class FalBatcher:
+    """Coalesce concurrent FAL submissions with identical arguments into one call"""
+
+    def __init__(self, model, max_batch_size=4, max_wait_time=0.1):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+        self.queue = asyncio.Queue()
+        self.worker = None
+        self.dispatches = set()
+
+    def start(self):
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = list(self.dispatches)
+        if self.worker:
+            tasks.append(self.worker)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
         
-        # Convert base64 images to PIL
-        user_image = base64_to_pil(user_image_b64)
-        clothing_image = base64_to_pil(clothing_image_b64)
+        # Cancel anything still waiting to be batched
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            future.cancel()
+
+    async def submit(self, arguments):
+        """Queue a generation and wait for its single-image result"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((arguments, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self.queue, self.max_batch_size, self.max_wait_time)
+            
+            # Only submissions with identical arguments can share a call
+            groups = {}
+            for arguments, future in batch:
+                key = tuple(sorted(arguments.items()))
+                groups.setdefault(key, []).append((arguments, future))
+            
+            for group in groups.values():
+                task = asyncio.create_task(self._dispatch(group))
+                self.dispatches.add(task)
+                task.add_done_callback(self.dispatches.discard)
+
+    async def _dispatch(self, group):
+        """Submit one FAL call for the group and route each image to its caller"""
+        try:
+            handler = await fal_client.submit_async(
+                self.model,
+                arguments={**group[0][0], "num_images": len(group)}
+            )
+            result = await handler.get() or {}
+            images = result.get('images', [])
+            
+            for i, (_, future) in enumerate(group):
+                if not future.done():
+                    future.set_result({**result, 'images': images[i:i + 1]})
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+        except asyncio.CancelledError:
+            for _, future in group:
+                future.cancel()
+            raise
+
+fal_batcher = FalBatcher("fal-ai/flux/dev")
+
+class BulkInserter:
+    """Coalesce concurrent inserts into a collection into unordered bulk writes"""
+
+    def __init__(self, collection, max_batch_size=50, max_wait_time=0.005):
+        self.collection = collection
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+        self.queue = asyncio.Queue()
+        self.worker = None
+
+    def start(self):
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker:
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
         
-        if not user_image or not clothing_image:
-            raise Exception("Failed to process uploaded images")
+        # Cancel inserts still waiting to be written
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            future.cancel()
 
-        # Create a comprehensive prompt for virtual try-on
-        prompt = f"""
-        Create a photorealistic virtual try-on image showing a person wearing the provided clothing item. 
-        The person should match these measurements: height {measurements.height}cm, weight {measurements.weight}kg, 
-        chest {measurements.chest}cm, waist {measurements.waist}cm, hips {measurements.hips}cm.
-        Style preference: {style}. 
-        The clothing should fit naturally and realistically on the person's body. 
-        Maintain the original person's appearance and facial features while showing them wearing the new outfit.
-        The final image should look natural, well-lit, and professional.
-        """
+    async def insert(self, document):
+        """Queue a document and wait until its batch has been written"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((document, future))
+        await future
 
-        # Use FAL.AI to generate the try-on image
-        logging.info("Calling FAL.AI for image generation...")
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self.queue, self.max_batch_size, self.max_wait_time)
+            errors = {}
+            try:
+                await self.collection.bulk_write(
+                    [InsertOne(document) for document, _ in batch],
+                    ordered=False
+                )
+            except BulkWriteError as e:
+                # Unordered writes still apply every document without an error
+                errors = {
+                    error['index']: Exception(error.get('errmsg', "Insert failed"))
+                    for error in e.details.get('writeErrors', [])
+                }
+            except Exception as e:
+                errors = {i: e for i in range(len(batch))}
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+            
+            for i, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if i in errors:
+                    future.set_exception(errors[i])
+                else:
+                    future.set_result(None)
+
+status_check_inserter = BulkInserter(status_checks)
+tryon_result_inserter = BulkInserter(db.tryon_results)
+
+# Successful generations keyed by their inputs, kept for a day
+tryon_cache = TTLCache(maxsize=1000, ttl=86400)
+
+def tryon_cache_key(user_image_data, clothing_image_data, prompt):
+    """Content hash of everything that determines a generated try-on"""
+    hasher = blake3()
+    for part in (user_image_data, clothing_image_data, prompt):
+        hasher.update(part.encode() if isinstance(part, str) else part)
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+async def generate_virtual_tryon(user_image_data, clothing_image_data, measurements, style, to_pil=base64_to_pil):
+    """Generate virtual try-on using FAL.AI
+
+    The images are base64 strings by default; pass to_pil=bytes_to_pil for raw uploads.
+    """
+    try:
+        # Create a comprehensive prompt for virtual try-on
+        prompt = PROMPT_TMPL.format_map(measurements.model_dump() | {"style": style})
         
-        # Use the image editing capability with both user and clothing images
-        handler = await fal_client.submit_async(
-            "fal-ai/flux/dev",
-            arguments={
-                "prompt": prompt,
-                "image_size": "portrait",
-                "num_inference_steps": 28,
-                "guidance_scale": 3.5,
-                "num_images": 1
-            }
+        # Identical inputs reuse the earlier result without calling FAL again
+        cache_key = tryon_cache_key(user_image_data, clothing_image_data, prompt)
+        if cache_key in tryon_cache:
+            logger.info("Returning cached try-on")
+            return tryon_cache[cache_key]
+        
+        # Convert uploaded images to PIL
+        loop = asyncio.get_running_loop()
+        user_image, clothing_image = await asyncio.gather(
+            loop.run_in_executor(POOL, to_pil, user_image_data),
+            loop.run_in_executor(POOL, to_pil, clothing_image_data)
         )
+        
+        if not user_image or not clothing_image:
+            logger.warning("Failed to process uploaded images")
+            return {
+                'success': False,
+                'error': "Failed to process uploaded images"
+            }
 
-        result = await handler.get()
+        # Use FAL.AI to generate the try-on image
+        logger.info("Calling FAL.AI for image generation...")
+        
+        # Identical concurrent requests are batched into a single FAL call
+        result = await fal_batcher.submit({
+            "prompt": prompt,
+            "image_size": "portrait",
+            "num_inference_steps": 28,
+            "guidance_scale": 3.5
+        })
         
         if result and 'images' in result and len(result['images']) > 0:
             # Get the generated image URL
             generated_image_url = result['images'][0]['url']
-            logging.info(f"Successfully generated image: {generated_image_url}")
+            logger.info("Successfully generated image: %s", generated_image_url)
             
             # For now, we'll return the URL as base64 data URL
             # In a production environment, you'd want to download and convert to base64
-            return {
+            generation_result = {
                 'success': True,
                 'tryon_image': generated_image_url,  # This will be a URL from FAL
                 'feedback': f"Virtual try-on generated successfully for {style} style!"
             }
+            tryon_cache[cache_key] = generation_result
+            return generation_result
         else:
             raise Exception("No images generated by FAL.AI")
             
     except Exception as e:
-        logging.error(f"Error in virtual try-on generation: {e}")
+        logger.exception("Error in virtual try-on generation")
         return {
             'success': False,
             'error': str(e)
@@ -164,104 +467,208 @@ async def root():
 
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
-    status_dict = input.dict()
+    status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
-    await db.status_checks.insert_one(status_obj.dict())
+    await status_check_inserter.insert(status_obj.model_dump())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+    cursor = status_checks.find().limit(1000)
+    # response_model validates the raw documents once; no per-row models needed
+    return [status_check async for status_check in cursor]
 
-@api_router.post("/tryon/generate")
-async def generate_tryon(request: TryOnRequest):
-    """Generate a virtual try-on image"""
+async def run_tryon(tryon_id, generation):
+    """Wait for the FAL generation of a try-on record and store the outcome"""
+    # Only settle records still processing, never one already timed out
+    pending = {"id": tryon_id, "status": "processing"}
     try:
-        logging.info(f"Received try-on request for {request.name}")
-        
-        # Validate required fields
-        if not request.user_image:
-            raise HTTPException(status_code=400, detail="User image is required")
-        if not request.clothing_image:
-            raise HTTPException(status_code=400, detail="Clothing image is required")
-        if not request.name.strip():
-            raise HTTPException(status_code=400, detail="Name is required")
-        
-        # Create initial try-on record
-        tryon_result = TryOnResult(
-            name=request.name,
-            measurements=request.measurements.dict(),
-            style=request.style,
-            status="processing"
-        )
-        
-        # Save to database
-        await db.tryon_results.insert_one(tryon_result.dict())
-        
-        # Generate the virtual try-on
-        generation_result = await generate_virtual_tryon(
-            request.user_image,
-            request.clothing_image, 
-            request.measurements,
-            request.style,
-            request.name
-        )
+        generation_result = await generation
         
         if generation_result['success']:
             # Update the record with results
-            tryon_result.tryon_image = generation_result['tryon_image']
-            tryon_result.feedback = generation_result['feedback']
-            tryon_result.status = "completed"
-            
-            # Update in database
             await db.tryon_results.update_one(
-                {"id": tryon_result.id},
-                {"$set": tryon_result.dict()}
+                pending,
+                {"$set": {
+                    "tryon_image": generation_result['tryon_image'],
+                    "feedback": generation_result['feedback'],
+                    "status": "completed"
+                }}
             )
             
-            logging.info(f"Successfully completed try-on for {request.name}")
-            
-            return {
-                "success": True,
-                "id": tryon_result.id,
-                "tryon_image": tryon_result.tryon_image,
-                "feedback": tryon_result.feedback,
-                "status": tryon_result.status
-            }
+            logger.info("Successfully completed try-on %s", tryon_id)
         else:
             # Update status to failed
-            tryon_result.status = "failed"
             await db.tryon_results.update_one(
-                {"id": tryon_result.id},
-                {"$set": {"status": "failed"}}
-            )
-            
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Failed to generate try-on: {generation_result.get('error', 'Unknown error')}"
+                pending,
+                {"$set": {
+                    "status": "failed",
+                    "feedback": f"Failed to generate try-on: {generation_result.get('error', 'Unknown error')}"
+                }}
             )
+    
+    except Exception:
+        logger.exception("Unexpected error in run_tryon")
+        await db.tryon_results.update_one(
+            pending,
+            {"$set": {"status": "failed"}}
+        )
+    finally:
+        active_tryons.discard(tryon_id)
+
+def poll_after(created_at):
+    """Suggest seconds until the next poll, shrinking as the job nears completion"""
+    elapsed = (datetime.utcnow() - created_at).total_seconds()
+    remaining = max(EXPECTED_TRYON_SECONDS - elapsed, 0)
+    # Jitter so clients that started together don't poll in lockstep
+    delay = max(1.0, remaining / 2) * random.uniform(0.8, 1.2)
+    return str(max(1, round(delay)))
+
+async def start_tryon(user_image, clothing_image, measurements, style, name, to_pil, background_tasks, response):
+    """Record a new try-on, start generating it and return the polling payload"""
+    # Validate required fields
+    if not user_image:
+        raise HTTPException(status_code=400, detail="User image is required")
+    if not clothing_image:
+        raise HTTPException(status_code=400, detail="Clothing image is required")
+    if not name.strip():
+        raise HTTPException(status_code=400, detail="Name is required")
+    
+    # Reject unsupported uploads before anything is recorded
+    if not detect_image_format(image_header(user_image)):
+        raise HTTPException(status_code=400, detail="User image must be PNG, JPEG or WebP")
+    if not detect_image_format(image_header(clothing_image)):
+        raise HTTPException(status_code=400, detail="Clothing image must be PNG, JPEG or WebP")
+    
+    # Create initial try-on record
+    tryon_result = TryOnResult(
+        name=name,
+        measurements=measurements.model_dump(),
+        style=style,
+        status="processing"
+    )
+    
+    # Start generating right away so the FAL submission overlaps the insert
+    active_tryons.add(tryon_result.id)
+    generation = asyncio.create_task(generate_virtual_tryon(
+        user_image,
+        clothing_image,
+        measurements,
+        style,
+        to_pil=to_pil
+    ))
+    
+    # Save to database; images are never persisted, only the result URL later
+    scheduled = False
+    try:
+        await tryon_result_inserter.insert(tryon_result.model_dump(exclude_none=True))
+        
+        # Store the outcome after the response is sent
+        background_tasks.add_task(run_tryon, tryon_result.id, generation)
+        scheduled = True
+    finally:
+        # Also covers cancellation, which would otherwise leave FAL running unobserved
+        if not scheduled:
+            generation.cancel()
+            active_tryons.discard(tryon_result.id)
+    
+    # Cache hits are already finished by now; let the client fetch them straight away
+    if generation.done():
+        response.headers["Retry-After"] = "1"
+    else:
+        response.headers["Retry-After"] = poll_after(tryon_result.created_at)
+    return {
+        "success": True,
+        "id": tryon_result.id,
+        "status": tryon_result.status
+    }
+
+@api_router.post("/tryon/generate", status_code=202)
+async def generate_tryon(request: TryOnRequest, background_tasks: BackgroundTasks, response: Response):
+    """Start a virtual try-on; poll /api/tryon/{id} for the result"""
+    try:
+        logger.info("Received try-on request")
+        
+        return await start_tryon(
+            request.user_image,
+            request.clothing_image,
+            request.measurements,
+            request.style,
+            request.name,
+            base64_to_pil,
+            background_tasks,
+            response
+        )
             
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Unexpected error in generate_tryon: {e}")
+        logger.exception("Unexpected error in generate_tryon")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.post("/tryon/generate_multipart", status_code=202)
+async def generate_tryon_multipart(
+    background_tasks: BackgroundTasks,
+    response: Response,
+    user_image: UploadFile = File(...),
+    clothing_image: UploadFile = File(...),
+    name: str = Form(...),
+    style: str = Form("casual"),
+    measurements: str = Form(...)
+):
+    """Start a virtual try-on from multipart uploads; poll /api/tryon/{id} for the result"""
+    try:
+        logger.info("Received multipart try-on request")
+        
+        try:
+            parsed_measurements = Measurements.model_validate_json(measurements)
+        except ValidationError:
+            raise HTTPException(status_code=400, detail="Invalid measurements")
+        
+        return await start_tryon(
+            await user_image.read(),
+            await clothing_image.read(),
+            parsed_measurements,
+            style,
+            name,
+            bytes_to_pil,
+            background_tasks,
+            response
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error in generate_tryon_multipart")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @api_router.get("/tryon/{tryon_id}")
-async def get_tryon_result(tryon_id: str):
+async def get_tryon_result(tryon_id: str, response: Response):
     """Get a specific try-on result"""
     try:
         result = await db.tryon_results.find_one({"id": tryon_id})
         if not result:
             raise HTTPException(status_code=404, detail="Try-on result not found")
         
-        return TryOnResult(**result)
+        tryon_result = TryOnResult(**result)
+        if tryon_result.status == "processing":
+            elapsed = (datetime.utcnow() - tryon_result.created_at).total_seconds()
+            if elapsed > STALE_TRYON_SECONDS and tryon_id not in active_tryons:
+                # Background tasks die with the process, so this job will never finish
+                tryon_result.status = "failed"
+                tryon_result.feedback = "Try-on generation timed out"
+                await db.tryon_results.update_one(
+                    {"id": tryon_id, "status": "processing"},
+                    {"$set": {"status": tryon_result.status, "feedback": tryon_result.feedback}}
+                )
+            else:
+                response.headers["Retry-After"] = poll_after(tryon_result.created_at)
+        return tryon_result
     
     except HTTPException:
         raise
-    except Exception as e:
-        logging.error(f"Error retrieving try-on result: {e}")
+    except Exception:
+        logger.exception("Error retrieving try-on result")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @api_router.get("/tryon/{tryon_id}/base64")
@@ -275,27 +682,37 @@ async def get_tryon_image_base64(tryon_id: str):
         if not result.get('tryon_image'):
             raise HTTPException(status_code=404, detail="Try-on image not available")
         
+        # Only the FAL URL is stored; encode the image on demand
+        image_base64 = result['tryon_image']
+        if image_base64.startswith("https://"):
+            image_base64 = await asyncio.shield(cached_image_base64(image_base64))
+        
         return {
             "success": True,
-            "image_base64": result['tryon_image'],
+            "image_base64": image_base64,
             "id": tryon_id
         }
     
     except HTTPException:
         raise
-    except Exception as e:
-        logging.error(f"Error retrieving try-on image: {e}")
+    except Exception:
+        logger.exception("Error retrieving try-on image")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @api_router.get("/tryons", response_model=List[TryOnResult])
 async def get_all_tryons():
     """Get all try-on results"""
     try:
-        results = await db.tryon_results.find().sort("created_at", -1).to_list(100)
-        return [TryOnResult(**result) for result in results]
+        # Image fields are not needed for listing and dominate document size
+        cursor = db.tryon_results.find(
+            {},
+            {"tryon_image": 0, "user_image_url": 0, "clothing_image_url": 0}
+        ).sort("created_at", -1).limit(100)
+        # response_model validates the raw documents once; no per-row models needed
+        return [result async for result in cursor]
     
-    except Exception as e:
-        logging.error(f"Error retrieving try-on results: {e}")
+    except Exception:
+        logger.exception("Error retrieving try-on results")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 # Include the router in the main app
@@ -307,18 +724,37 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+@app.on_event("startup")
+async def create_http_client():
+    # Shared so image downloads reuse keep-alive connections instead of new TLS handshakes;
+    # fal_client already keeps a single module-level session of its own
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32)
+    )
+
+@app.on_event("startup")
+async def create_indexes():
+    await db.tryon_results.create_index([("created_at", -1)])
+    await db.tryon_results.create_index("id", unique=True)
+
+@app.on_event("startup")
+async def start_batchers():
+    fal_batcher.start()
+    status_check_inserter.start()
+    tryon_result_inserter.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await fal_batcher.stop()
+    await status_check_inserter.stop()
+    await tryon_result_inserter.stop()
+    await app.state.http.aclose()
     client.close()
+    POOL.shutdown(wait=False)
 
 if __name__ == "__main__":
     import uvicorn
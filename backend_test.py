@@ -1,6 +1,7 @@
 import requests
 import sys
 import json
+import time
 import base64
 from datetime import datetime
 from io import BytesIO
@@ -25,11 +26,30 @@ class VirtualTryOnAPITester:
             print(f"Error creating sample image: {e}")
             return None
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, headers=None):
+    def create_sample_image_bytes(self, color="red", size=(200, 200)):
+        """Create a sample PNG image and return its raw bytes"""
+        img = Image.new('RGB', size, color=color)
+        buffer = BytesIO()
+        img.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def wait_for_tryon(self, tryon_id, max_polls=30):
+        """Poll a try-on until it leaves "processing", without counting each poll as a test"""
+        for _ in range(max_polls):
+            try:
+                response = requests.get(f"{self.base_url}/api/tryon/{tryon_id}", timeout=30)
+                if response.status_code != 200 or response.json().get('status') != "processing":
+                    return
+            except requests.exceptions.RequestException:
+                return
+            time.sleep(2)
+
+    def run_test(self, name, method, endpoint, expected_status, data=None, headers=None, files=None):
         """Run a single API test"""
         url = f"{self.base_url}/{endpoint}"
         if headers is None:
-            headers = {'Content-Type': 'application/json'}
+            # Multipart requests need requests to set the boundary header itself
+            headers = {} if files else {'Content-Type': 'application/json'}
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -38,6 +58,8 @@ class VirtualTryOnAPITester:
         try:
             if method == 'GET':
                 response = requests.get(url, headers=headers, timeout=30)
+            elif method == 'POST' and files:
+                response = requests.post(url, data=data, files=files, headers=headers, timeout=60)
             elif method == 'POST':
                 response = requests.post(url, json=data, headers=headers, timeout=60)
             elif method == 'PUT':
@@ -133,14 +155,15 @@ class VirtualTryOnAPITester:
             "Virtual Try-On Generation",
             "POST",
             "api/tryon/generate",
-            200,
+            202,
             data=tryon_data
         )
         
         if success and isinstance(response, dict):
             tryon_id = response.get('id')
             if tryon_id:
-                # Test getting the specific try-on result
+                # Wait for generation to finish, then check the result once
+                self.wait_for_tryon(tryon_id)
                 success2, response2 = self.run_test(
                     "Get Try-On Result",
                     "GET",
@@ -160,6 +183,65 @@ class VirtualTryOnAPITester:
         
         return success
 
+    def test_tryon_multipart_generation(self):
+        """Test the multipart try-on generation endpoint"""
+        measurements = {
+            "height": "170",
+            "weight": "65",
+            "chest": "90",
+            "waist": "75",
+            "hips": "95"
+        }
+        
+        success, response = self.run_test(
+            "Multipart Virtual Try-On Generation",
+            "POST",
+            "api/tryon/generate_multipart",
+            202,
+            data={
+                "name": "Test User",
+                "style": "casual",
+                "measurements": json.dumps(measurements)
+            },
+            files={
+                "user_image": ("user.png", self.create_sample_image_bytes("blue", (300, 400)), "image/png"),
+                "clothing_image": ("clothing.png", self.create_sample_image_bytes("green", (200, 300)), "image/png")
+            }
+        )
+        
+        if success and isinstance(response, dict):
+            tryon_id = response.get('id')
+            if tryon_id:
+                # Wait for generation to finish, then check the result once
+                self.wait_for_tryon(tryon_id)
+                success2, response2 = self.run_test(
+                    "Get Multipart Try-On Result",
+                    "GET",
+                    f"api/tryon/{tryon_id}",
+                    200
+                )
+                
+                success = success and success2
+        
+        # Test with malformed measurements
+        success3, _ = self.run_test(
+            "Validation - Malformed Multipart Measurements",
+            "POST",
+            "api/tryon/generate_multipart",
+            400,
+            data={
+                "name": "Test User",
+                "style": "casual",
+                "measurements": "not json"
+            },
+            files={
+                "user_image": ("user.png", self.create_sample_image_bytes("blue"), "image/png"),
+                "clothing_image": ("clothing.png", self.create_sample_image_bytes("green"), "image/png")
+            }
+        )
+        
+        return success and success3
+
     def test_tryon_validation(self):
         """Test try-on endpoint validation"""
         # Test with missing user image
@@ -241,6 +323,7 @@ def main():
         ("Basic Connectivity", tester.test_basic_connectivity),
         ("Status Endpoints", tester.test_status_endpoints),
         ("Try-On Generation", tester.test_tryon_generation),
+        ("Multipart Try-On Generation", tester.test_tryon_multipart_generation),
         ("Try-On Validation", tester.test_tryon_validation),
         ("Get All Try-Ons", tester.test_get_all_tryons),
         ("Non-existent Try-On", tester.test_nonexistent_tryon),
@@ -3,6 +3,8 @@ import { useNavigate } from "react-router-dom";
 import "./TryOnApp.css";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+// The backend fails abandoned try-ons after 100s; stop polling a little later
+const MAX_POLL_SECONDS = 180;
 
 const TryOnApp = () => {
   const navigate = useNavigate();
@@ -114,14 +116,36 @@ const TryOnApp = () => {
 
       setLoadingMessage("Creating your ultra-realistic 3D model...");
       
-      const data = await response.json();
+      const { id } = await response.json();
+      let retryAfter = response.headers.get('Retry-After');
       
-      if (data.success) {
+      // Poll until the try-on has finished generating, giving up after a while
+      const deadline = Date.now() + MAX_POLL_SECONDS * 1000;
+      let data;
+      while (true) {
+        if (Date.now() > deadline) {
+          throw new Error("Timed out waiting for the try-on result");
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, (Number(retryAfter) || 2) * 1000));
+        
+        const pollResponse = await fetch(`${BACKEND_URL}/api/tryon/${id}`);
+        if (!pollResponse.ok) {
+          const errorData = await pollResponse.json();
+          throw new Error(errorData.detail || `HTTP error! status: ${pollResponse.status}`);
+        }
+        
+        data = await pollResponse.json();
+        if (data.status !== "processing") break;
+        retryAfter = pollResponse.headers.get('Retry-After');
+      }
+      
+      if (data.status === "completed") {
         setLoadingMessage("Finalizing your virtual try-on...");
         setResult(data);
         setStep(3); // Move to results step
       } else {
-        throw new Error(data.error || "Failed to generate try-on");
+        throw new Error(data.feedback || "Failed to generate try-on");
       }
       
     } catch (err) {
@@ -221,7 +245,7 @@ const TryOnApp = () => {
                     <label className="upload-label">
                       <input
                         type="file"
-                        accept="image/*"
+                        accept="image/png,image/jpeg,image/webp"
                         onChange={(e) => handleImageUpload('userImage', e.target.files[0])}
                       />
                       <div className="upload-placeholder">
@@ -250,7 +274,7 @@ const TryOnApp = () => {
                     <label className="upload-label">
                       <input
                         type="file"
-                        accept="image/*"
+                        accept="image/png,image/jpeg,image/webp"
                         onChange={(e) => handleImageUpload('clothingImage', e.target.files[0])}
                       />
                       <div className="upload-placeholder">
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# server.py lives in backend/ and is run as a script, not installed as a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,91 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+from server import BulkInserter
+
+
+class FakeCollection:
+    """Records bulk writes; can fail given indexes or the whole call"""
+
+    def __init__(self, failing_indexes=(), error=None, delay=0):
+        self.batches = []
+        self.failing_indexes = failing_indexes
+        self.error = error
+        self.delay = delay
+
+    async def bulk_write(self, requests, ordered=True):
+        assert not ordered
+        await asyncio.sleep(self.delay)
+        self.batches.append([request._doc for request in requests])
+        if self.error:
+            raise self.error
+        if self.failing_indexes:
+            raise BulkWriteError({"writeErrors": [
+                {"index": index, "errmsg": f"duplicate {index}"} for index in self.failing_indexes
+            ]})
+
+
+def run_inserts(collection, documents, **kwargs):
+    async def run():
+        inserter = BulkInserter(collection, **kwargs)
+        inserter.start()
+        results = await asyncio.gather(
+            *[inserter.insert(document) for document in documents],
+            return_exceptions=True
+        )
+        await inserter.stop()
+        return results
+    
+    return asyncio.run(run())
+
+
+def test_concurrent_inserts_share_a_bulk_write():
+    collection = FakeCollection()
+    results = run_inserts(collection, [{"n": i} for i in range(3)])
+    
+    assert results == [None, None, None]
+    assert collection.batches == [[{"n": 0}, {"n": 1}, {"n": 2}]]
+
+
+def test_batches_are_capped():
+    collection = FakeCollection()
+    run_inserts(collection, [{"n": i} for i in range(5)], max_batch_size=2)
+    
+    assert [len(batch) for batch in collection.batches] == [2, 2, 1]
+
+
+def test_write_errors_reach_only_their_documents():
+    collection = FakeCollection(failing_indexes=(1,))
+    results = run_inserts(collection, [{"n": i} for i in range(3)])
+    
+    assert results[0] is None and results[2] is None
+    assert str(results[1]) == "duplicate 1"
+
+
+def test_other_errors_reach_the_whole_batch():
+    collection = FakeCollection(error=RuntimeError("connection lost"))
+    results = run_inserts(collection, [{"n": i} for i in range(2)])
+    
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_stop_cancels_pending_inserts():
+    async def run():
+        inserter = BulkInserter(FakeCollection(delay=10), max_batch_size=1)
+        inserter.start()
+        inserts = [asyncio.ensure_future(inserter.insert({"n": i})) for i in range(3)]
+        await asyncio.sleep(0.01)
+        
+        await inserter.stop()
+        results = await asyncio.gather(*inserts, return_exceptions=True)
+        return results, inserter.worker.done()
+    
+    results, worker_done = asyncio.run(run())
+    # One insert was mid-write and the others still queued; none is left hanging
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert worker_done
+
+
+def test_stop_before_start_is_harmless():
+    asyncio.run(BulkInserter(FakeCollection()).stop())
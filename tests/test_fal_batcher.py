@@ -0,0 +1,154 @@
+import asyncio
+
+import server
+from server import FalBatcher, collect_batch
+
+
+class StubHandler:
+    def __init__(self, arguments, delay):
+        self.arguments = arguments
+        self.delay = delay
+
+    async def get(self):
+        await asyncio.sleep(self.delay)
+        return {"images": [{"url": f"image-{i}"} for i in range(self.arguments["num_images"])]}
+
+
+def stub_fal(monkeypatch, calls, delay=0.01, error=None):
+    """Replace fal_client.submit_async, recording the arguments of each call"""
+    async def submit_async(model, arguments):
+        calls.append(arguments)
+        if error:
+            raise error
+        return StubHandler(arguments, delay)
+    
+    monkeypatch.setattr(server.fal_client, "submit_async", submit_async)
+
+
+def test_collect_batch_stops_at_max_batch_size():
+    async def run():
+        queue = asyncio.Queue()
+        for i in range(5):
+            queue.put_nowait(i)
+        return await collect_batch(queue, 3, 1), queue.qsize()
+    
+    assert asyncio.run(run()) == ([0, 1, 2], 2)
+
+
+def test_collect_batch_returns_after_wait_window():
+    async def run():
+        queue = asyncio.Queue()
+        queue.put_nowait("only")
+        return await collect_batch(queue, 10, 0.01)
+    
+    assert asyncio.run(run()) == ["only"]
+
+
+def test_collect_batch_hands_items_back_when_cancelled():
+    async def run():
+        queue = asyncio.Queue()
+        queue.put_nowait("first")
+        queue.put_nowait("second")
+        task = asyncio.create_task(collect_batch(queue, 10, 10))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+    
+    assert asyncio.run(run()) == ["first", "second"]
+
+
+def test_identical_submissions_share_one_call(monkeypatch):
+    calls = []
+    stub_fal(monkeypatch, calls)
+    
+    async def run():
+        batcher = FalBatcher("model", max_wait_time=0.05)
+        batcher.start()
+        results = await asyncio.gather(*[batcher.submit({"prompt": "a"}) for _ in range(3)])
+        await batcher.stop()
+        return results
+    
+    results = asyncio.run(run())
+    assert calls == [{"prompt": "a", "num_images": 3}]
+    # Each caller gets exactly one image, and no two callers share one
+    assert sorted(result["images"][0]["url"] for result in results) == ["image-0", "image-1", "image-2"]
+    assert all(len(result["images"]) == 1 for result in results)
+
+
+def test_different_arguments_are_not_batched(monkeypatch):
+    calls = []
+    stub_fal(monkeypatch, calls)
+    
+    async def run():
+        batcher = FalBatcher("model", max_wait_time=0.05)
+        batcher.start()
+        await asyncio.gather(
+            batcher.submit({"prompt": "a"}),
+            batcher.submit({"prompt": "b"}),
+            batcher.submit({"prompt": "a"})
+        )
+        await batcher.stop()
+    
+    asyncio.run(run())
+    assert sorted(calls, key=lambda call: call["prompt"]) == [
+        {"prompt": "a", "num_images": 2},
+        {"prompt": "b", "num_images": 1}
+    ]
+
+
+def test_batch_size_is_capped(monkeypatch):
+    calls = []
+    stub_fal(monkeypatch, calls)
+    
+    async def run():
+        batcher = FalBatcher("model", max_batch_size=2, max_wait_time=0.05)
+        batcher.start()
+        await asyncio.gather(*[batcher.submit({"prompt": "a"}) for _ in range(3)])
+        await batcher.stop()
+    
+    asyncio.run(run())
+    assert sorted(call["num_images"] for call in calls) == [1, 2]
+
+
+def test_failed_call_reaches_every_caller(monkeypatch):
+    calls = []
+    stub_fal(monkeypatch, calls, error=RuntimeError("FAL down"))
+    
+    async def run():
+        batcher = FalBatcher("model", max_wait_time=0.05)
+        batcher.start()
+        results = await asyncio.gather(
+            *[batcher.submit({"prompt": "a"}) for _ in range(2)],
+            return_exceptions=True
+        )
+        await batcher.stop()
+        return results
+    
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_stop_cancels_in_flight_and_queued_submissions(monkeypatch):
+    calls = []
+    stub_fal(monkeypatch, calls, delay=10)
+    
+    async def run():
+        batcher = FalBatcher("model", max_batch_size=2, max_wait_time=10)
+        batcher.start()
+        # A full batch is dispatched at once; the next submission waits in collection
+        in_flight = [asyncio.ensure_future(batcher.submit({"prompt": "a"})) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        collecting = asyncio.ensure_future(batcher.submit({"prompt": "b"}))
+        await asyncio.sleep(0.01)
+        
+        await batcher.stop()
+        results = await asyncio.gather(*in_flight, collecting, return_exceptions=True)
+        return results, batcher.dispatches, batcher.worker.done()
+    
+    results, dispatches, worker_done = asyncio.run(run())
+    assert calls == [{"prompt": "a", "num_images": 2}]
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert not dispatches
+    assert worker_done